@@ -1,63 +1,487 @@
-import os
-import sqlite3
-from pathlib import Path
-from PIL import Image
-import imagehash
-
-APPDATA = Path(os.getenv("APPDATA")) / "WallpaperFinder"
-DB_PATH = APPDATA / "wallpaper_index.db"
-TRANSCODED = Path(os.getenv("APPDATA")) / "Microsoft" / "Windows" / "Themes" / "TranscodedWallpaper"
-
-
-def phash_image(path: Path):
-    with Image.open(path) as img:
-        img = img.convert("RGB")
-        return imagehash.phash(img)
-
-
-def find_best_match():
-    if not TRANSCODED.exists():
-        raise FileNotFoundError(f"TranscodedWallpaper not found: {TRANSCODED}")
-    if not DB_PATH.exists():
-        raise FileNotFoundError(f"Database not found: {DB_PATH}")
-
-    wall_hash = phash_image(TRANSCODED)
-
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT source_type, source_path, file_name, phash FROM images")
-    rows = cur.fetchall()
-    conn.close()
-
-    best = None
-    best_dist = 10**9
-
-    for source_type, source_path, file_name, phash_hex in rows:
-        try:
-            stored_hash = imagehash.hex_to_hash(phash_hex)
-            dist = wall_hash - stored_hash
-        except Exception:
-            continue
-
-        if dist < best_dist:
-            best_dist = dist
-            best = (source_type, Path(source_path), file_name)
-
-    return best, best_dist
-
-
-def main():
-    match, dist = find_best_match()
-    if not match:
-        print("No match found.")
-        return
-
-    source_type, source_path, file_name = match
-    print(f"Best match ({dist}):")
-    print(f"Type: {source_type}")
-    print(f"Source: {source_path}")
-    print(f"File: {file_name}")
-
-
-if __name__ == "__main__":
-    main()
+import os
+import pickle
+import sqlite3
+from pathlib import Path
+import numpy as np
+from PIL import Image
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+APPDATA = Path(os.getenv("APPDATA")) / "WallpaperFinder"
+DB_PATH = APPDATA / "wallpaper_index.db"
+HASHES_PATH = APPDATA / "hashes.bin"     # raw little-endian uint64 phashes
+AHASHES_PATH = APPDATA / "ahashes.bin"   # raw little-endian uint64 ahashes
+META_PATH = APPDATA / "meta.pkl"         # pickled (source_type, source_path, file_name) rows
+TRANSCODED = Path(os.getenv("APPDATA")) / "Microsoft" / "Windows" / "Themes" / "TranscodedWallpaper"
+
+# Popcount of every byte value, used to sum Hamming distance per hash.
+_POPCOUNT8 = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+# In-process match index: loaded from disk once and reused until the DB changes.
+_match_cache = {
+    "mtime": None, "hashes": None, "ahashes": None, "meta": None, "lanes": None
+}
+
+# Wallpaper memo: Windows leaves TranscodedWallpaper untouched between
+# rotations, so its (mtime, size) decides whether anything needs re-hashing.
+_wall_cache = {"sig": None, "db_mtime": None, "hash": None, "result": None}
+
+# Long-lived read-only connection for the match path.
+_read_conn = None
+
+
+def get_read_conn():
+    """Open (once) a read-only connection; mode=ro keeps SQLite from touching
+    the journal/WAL, and the pragmas avoid re-growing the page cache per run."""
+    global _read_conn
+    if _read_conn is None:
+        _read_conn = sqlite3.connect(
+            f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False
+        )
+        _read_conn.execute("PRAGMA cache_size=-65536")
+        _read_conn.execute("PRAGMA mmap_size=268435456")
+        _read_conn.create_function(
+            "hamming", 2,
+            lambda a, b: ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count(),
+            deterministic=True,
+        )
+    return _read_conn
+
+
+def close_read_conn():
+    global _read_conn
+    if _read_conn is not None:
+        _read_conn.close()
+        _read_conn = None
+
+
+def _dct_matrix(n: int, rows: int) -> np.ndarray:
+    """First `rows` basis rows of the n-point DCT-II matrix.
+
+    The uniform DCT scale factor is dropped: the hash only compares
+    coefficients against their median, which any positive scaling preserves.
+    """
+    k = np.arange(n)
+    j = np.arange(rows)[:, None]
+    return np.cos(np.pi * j * (2 * k + 1) / (2 * n)).astype(np.float32)
+
+
+# Partial 32-point DCT: M8 @ a @ M8.T yields the 8x8 low-frequency block
+# directly as two tiny GEMMs, never computing the 24x24 block we discard.
+_DCT32_8 = _dct_matrix(32, 8)
+
+
+def luma_plane(img) -> np.ndarray:
+    """The 32x32 uint8 luma plane both hashes are computed from."""
+    if img.mode != "L":  # draft-mode JPEGs already arrive as luma
+        img = img.convert("L")
+    return np.asarray(img.resize((32, 32), Image.Resampling.BILINEAR))
+
+
+def hashes_from_plane(a: np.ndarray):
+    """(phash, ahash) from one 32x32 float32 luma plane."""
+    low = (_DCT32_8 @ a @ _DCT32_8.T).ravel()
+    med = np.median(low[1:])  # DC term would skew the median
+    ph = int.from_bytes(np.packbits(low > med).tobytes(), "big")
+    blocks = a.reshape(8, 4, 8, 4).mean(axis=(1, 3)).ravel()
+    ah = int.from_bytes(np.packbits(blocks > blocks.mean()).tobytes(), "big")
+    return ph, ah
+
+
+def hash_pair(img):
+    """(phash, ahash) of a PIL image from one 32x32 float32 luma plane.
+
+    phash is the usual construction (8x8 low-frequency DCT block vs its
+    median), with the fixed-size DCT specialized to a precomputed matrix
+    product that BLAS turns into two small GEMMs. ahash is the classic
+    average hash: 8x8 block means thresholded at their overall mean, read off
+    the same 32x32 plane for free. It is far less selective but ~free to
+    compare, so the matcher uses it as a prefilter in front of phash.
+    """
+    return hashes_from_plane(luma_plane(img).astype(np.float32))
+
+
+def fast_phash(img) -> int:
+    return hash_pair(img)[0]
+
+
+def hash_pair_from_path(path: Path):
+    with Image.open(path) as img:
+        # For JPEGs, libjpeg can decode at a reduced scale straight to
+        # grayscale; 64x64 keeps one halving step above the 32x32 hash input.
+        img.draft("L", (64, 64))
+        return hash_pair(img)
+
+
+def phash_image(path: Path) -> int:
+    return hash_pair_from_path(path)[0]
+
+
+def phash_to_db(h) -> int:
+    """Reinterpret a 64-bit hash as signed, since SQLite INTEGER is int64."""
+    h = int(h)
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+def phash_from_db(v: int) -> int:
+    return v & 0xFFFFFFFFFFFFFFFF
+
+
+def migrate_phash_integer(conn):
+    """Rewrite a legacy phash column (hex TEXT or 8-byte BLOB) as INTEGER."""
+    cur = conn.cursor()
+    row = cur.execute(
+        "SELECT type FROM pragma_table_info('images') WHERE name = 'phash'"
+    ).fetchone()
+    if row is None or row[0] == "INTEGER":
+        return
+    legacy_text = row[0] == "TEXT"
+    cur.execute("""
+        CREATE TABLE images_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_type TEXT NOT NULL,
+            source_path TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            phash INTEGER NOT NULL
+        )
+    """)
+    rows = cur.execute(
+        "SELECT id, source_type, source_path, file_name, phash FROM images"
+    ).fetchall()
+    cur.executemany(
+        "INSERT INTO images_new (id, source_type, source_path, file_name, phash) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (
+            (rowid, src_type, src_path, name,
+             phash_to_db(int(phash, 16) if legacy_text
+                         else int.from_bytes(phash, "big")))
+            for rowid, src_type, src_path, name, phash in rows
+        ),
+    )
+    cur.execute("DROP TABLE images")
+    cur.execute("ALTER TABLE images_new RENAME TO images")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_phash ON images(phash)")
+    conn.commit()
+
+
+def migrate_add_ahash(conn):
+    """Add the ahash column to pre-ahash indexes; legacy rows stay NULL until
+    the source is re-indexed."""
+    cur = conn.cursor()
+    present = cur.execute(
+        "SELECT COUNT(*) FROM pragma_table_info('images') WHERE name = 'ahash'"
+    ).fetchone()[0]
+    if not present:
+        cur.execute("ALTER TABLE images ADD COLUMN ahash INTEGER")
+        conn.commit()
+
+
+def ensure_schema_current():
+    """Return the read connection, migrating legacy phash columns first."""
+    conn = get_read_conn()
+    row = conn.execute(
+        "SELECT type FROM pragma_table_info('images') WHERE name = 'phash'"
+    ).fetchone()
+    has_ahash = conn.execute(
+        "SELECT COUNT(*) FROM pragma_table_info('images') WHERE name = 'ahash'"
+    ).fetchone()[0]
+    if row is not None and (row[0] != "INTEGER" or not has_ahash):
+        close_read_conn()  # legacy schema needs a writable migration pass
+        rw_conn = sqlite3.connect(DB_PATH)
+        migrate_phash_integer(rw_conn)
+        migrate_add_ahash(rw_conn)
+        rw_conn.close()
+        conn = get_read_conn()
+    return conn
+
+
+if gmpy2 is not None:
+    def hamdist(a: int, b: int) -> int:
+        return int(gmpy2.hamdist(a, b))
+else:
+    # int.bit_count compiles to a single POPCNT on 3.10+; gmpy2 just shaves
+    # the XOR-object churn when it is around.
+    def hamdist(a: int, b: int) -> int:
+        return (a ^ b).bit_count()
+
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _batch_hamming(arr, q):
+        # Kernighan popcount; LLVM recognizes the idiom and emits POPCNT.
+        out = np.empty(arr.size, dtype=np.uint8)
+        one = np.uint64(1)
+        for i in numba.prange(arr.size):
+            x = arr[i] ^ q
+            d = 0
+            while x:
+                x &= x - one
+                d += 1
+            out[i] = d
+        return out
+else:
+    _batch_hamming = None
+
+
+def hamming_argmin(hashes, wall_u64):
+    """Return (index, distance) of the closest stored hash.
+
+    With numba installed the whole reduction runs as a jitted parallel
+    popcount kernel. Otherwise two stages: the popcount of one 16-bit lane
+    is a lower bound on the full distance, so every row is ranked by that
+    cheap lane first and only rows that could still beat the best seen get a
+    full popcount, bailing out on a perfect match.
+    """
+    if _batch_hamming is not None:
+        dists = _batch_hamming(np.ascontiguousarray(hashes), wall_u64)
+        best_idx = int(dists.argmin())
+        return best_idx, int(dists[best_idx])
+
+    xor = (hashes ^ wall_u64).view(np.uint8).reshape(-1, 8)
+    lane = _POPCOUNT8[xor[:, :2]].sum(axis=1)
+
+    wall_int = int(wall_u64)
+    best_idx = int(lane.argmin())
+    best = hamdist(int(hashes[best_idx]), wall_int)
+    if best == 0:
+        return best_idx, 0
+
+    # d >= lane for every row, so only lane < best can improve on it.
+    for i in np.flatnonzero(lane < best):
+        d = hamdist(int(hashes[i]), wall_int)
+        if d < best:
+            best, best_idx = d, int(i)
+            if best == 0:
+                break
+    return best_idx, best
+
+
+# A row this close to the wallpaper must match one 16-bit lane exactly
+# (pigeonhole: 4 lanes, so <=3 mismatched bits cannot touch all of them).
+PIGEON_RADIUS = 3
+
+
+def _build_lane_buckets(hashes):
+    """Split every stored hash into 4x16-bit lanes and bucket the row indices
+    by lane value: four dicts mapping u16 -> sorted index array."""
+    lanes = np.ascontiguousarray(hashes).view("<u2").reshape(-1, 4)
+    buckets = []
+    for c in range(4):
+        col = lanes[:, c]
+        order = np.argsort(col, kind="stable")
+        svals = col[order]
+        starts = np.flatnonzero(np.r_[True, svals[1:] != svals[:-1]])
+        ends = np.r_[starts[1:], svals.size]
+        buckets.append({int(svals[s]): order[s:e] for s, e in zip(starts, ends)})
+    return buckets
+
+
+def lane_buckets():
+    """Lane buckets for the cached index, built lazily once per index load."""
+    if _match_cache["lanes"] is None and _match_cache["hashes"] is not None:
+        _match_cache["lanes"] = _build_lane_buckets(_match_cache["hashes"])
+    return _match_cache["lanes"]
+
+
+def pigeonhole_argmin(hashes, buckets, wall_u64):
+    """Resolve the argmin from lane buckets when it lies within PIGEON_RADIUS.
+
+    Candidates are the union of the rows sharing any 16-bit lane with the
+    query -- typically a handful out of the whole catalog. If the best of
+    them is within the radius it is provably the global argmin (every other
+    row differs in all four lanes, i.e. by more than the radius); otherwise
+    return None and let the caller fall back to a full scan.
+    """
+    qlanes = np.array([wall_u64], dtype="<u8").view("<u2")
+    cand = [buckets[c].get(int(qlanes[c])) for c in range(4)]
+    cand = [c for c in cand if c is not None]
+    if not cand:
+        return None
+    idx = np.unique(np.concatenate(cand))
+    xor = (hashes[idx] ^ wall_u64).view(np.uint8).reshape(-1, 8)
+    dists = _POPCOUNT8[xor].sum(axis=1)
+    j = int(dists.argmin())
+    if dists[j] > PIGEON_RADIUS:
+        return None
+    return int(idx[j]), int(dists[j])
+
+
+# Candidate count kept after the ahash prefilter.
+AHASH_TOPK = 64
+
+
+def two_stage_argmin(hashes, ahashes, wall_ph_u64, wall_ah_u64):
+    """ahash-prefiltered argmin: rank every row by the cheap average-hash
+    distance, then phash-verify only the AHASH_TOPK best candidates."""
+    if ahashes.size <= AHASH_TOPK:
+        return hamming_argmin(hashes, wall_ph_u64)
+
+    xor = (ahashes ^ wall_ah_u64).view(np.uint8).reshape(-1, 8)
+    adists = _POPCOUNT8[xor].sum(axis=1)
+    cand = np.argpartition(adists, AHASH_TOPK)[:AHASH_TOPK]
+
+    wall_int = int(wall_ph_u64)
+    best_idx, best = -1, 65
+    for i in cand:
+        d = hamdist(int(hashes[i]), wall_int)
+        if d < best:
+            best, best_idx = d, int(i)
+            if best == 0:
+                break
+    return best_idx, best
+
+
+def load_match_index():
+    """Load (hashes, ahashes, meta) for the catalog, cached until the DB changes.
+
+    Hashes are memmapped from the flat sidecars when the indexer wrote them
+    (they mirror the images table in id order); otherwise everything is
+    rebuilt from the table itself.
+    """
+    mtime = DB_PATH.stat().st_mtime_ns
+    if _match_cache["mtime"] == mtime:
+        return _match_cache["hashes"], _match_cache["ahashes"], _match_cache["meta"]
+
+    close_read_conn()  # the DB may have been rebuilt as a new file
+    conn = ensure_schema_current()
+    mtime = DB_PATH.stat().st_mtime_ns
+    count = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    hashes = ahashes = meta = None
+    if HASHES_PATH.exists() and META_PATH.exists():
+        try:
+            with open(META_PATH, "rb") as f:
+                meta = pickle.load(f)
+            mm = np.memmap(HASHES_PATH, dtype="<u8", mode="r")
+            if len(meta) == count and mm.size == count:
+                hashes = mm
+                if AHASHES_PATH.exists():
+                    amm = np.memmap(AHASHES_PATH, dtype="<u8", mode="r")
+                    if amm.size == count:
+                        ahashes = amm
+            else:
+                meta = None
+        except Exception:
+            hashes = ahashes = meta = None
+
+    if meta is None:  # stale or missing sidecars: rebuild from the table
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT source_type, source_path, file_name, phash, ahash FROM images ORDER BY id"
+        )
+        rows = cur.fetchall()
+        meta = [(row[0], row[1], row[2]) for row in rows]
+        hashes = np.fromiter(
+            (row[3] for row in rows), dtype=np.int64, count=len(rows)
+        ).view(np.uint64)
+        # Rows indexed before the ahash column stay NULL; the prefilter only
+        # applies once the whole catalog has been re-indexed with both hashes.
+        if rows and all(row[4] is not None for row in rows):
+            ahashes = np.fromiter(
+                (row[4] for row in rows), dtype=np.int64, count=len(rows)
+            ).view(np.uint64)
+
+    _match_cache.update(
+        mtime=mtime, hashes=hashes, ahashes=ahashes, meta=meta, lanes=None
+    )
+    return hashes, ahashes, meta
+
+
+def find_best_match():
+    if not TRANSCODED.exists():
+        raise FileNotFoundError(f"TranscodedWallpaper not found: {TRANSCODED}")
+    if not DB_PATH.exists():
+        raise FileNotFoundError(f"Database not found: {DB_PATH}")
+
+    st = TRANSCODED.stat()
+    wall_sig = (st.st_mtime_ns, st.st_size)
+    db_mtime = DB_PATH.stat().st_mtime_ns
+
+    if _wall_cache["sig"] == wall_sig:
+        if _wall_cache["db_mtime"] == db_mtime:
+            return _wall_cache["result"]
+        wall_ph, wall_ah = _wall_cache["hash"]  # same wallpaper, index changed
+    else:
+        wall_ph, wall_ah = hash_pair_from_path(TRANSCODED)
+
+    # Unchanged re-encodes are the common case, so try a sub-ms exact lookup
+    # through the idx_phash B-tree before any Hamming scan.
+    exact = ensure_schema_current().execute(
+        "SELECT source_type, source_path, file_name FROM images WHERE phash = ? LIMIT 1",
+        (phash_to_db(wall_ph),)
+    ).fetchone()
+    if exact is not None:
+        result = (exact[0], Path(exact[1]), exact[2]), 0
+        _wall_cache.update(
+            sig=wall_sig, db_mtime=db_mtime, hash=(wall_ph, wall_ah), result=result
+        )
+        return result
+
+    hashes, ahashes, meta = load_match_index()
+    if not meta:
+        return None, 10**9
+
+    hit = pigeonhole_argmin(hashes, lane_buckets(), np.uint64(wall_ph))
+    if hit is not None:
+        best_idx, best_dist = hit
+    elif ahashes is not None:
+        best_idx, best_dist = two_stage_argmin(
+            hashes, ahashes, np.uint64(wall_ph), np.uint64(wall_ah)
+        )
+    else:
+        best_idx, best_dist = hamming_argmin(hashes, np.uint64(wall_ph))
+    source_type, source_path, file_name = meta[best_idx]
+    result = (source_type, Path(source_path), file_name), best_dist
+    _wall_cache.update(
+        sig=wall_sig, db_mtime=db_mtime, hash=(wall_ph, wall_ah), result=result
+    )
+    return result
+
+
+def sql_best_match():
+    """One-shot variant: let SQLite compute the argmin via the hamming UDF.
+
+    For a single query this skips materializing every row through the row
+    factory; repeated queries (the tray app) use find_best_match's cached
+    scan instead.
+    """
+    if not TRANSCODED.exists():
+        raise FileNotFoundError(f"TranscodedWallpaper not found: {TRANSCODED}")
+    if not DB_PATH.exists():
+        raise FileNotFoundError(f"Database not found: {DB_PATH}")
+
+    wall_hash = phash_image(TRANSCODED)
+    conn = ensure_schema_current()
+    row = conn.execute(
+        "SELECT source_type, source_path, file_name, hamming(phash, ?) AS d "
+        "FROM images ORDER BY d LIMIT 1",
+        (phash_to_db(wall_hash),)
+    ).fetchone()
+    if row is None:
+        return None, 10**9
+    return (row[0], Path(row[1]), row[2]), row[3]
+
+
+def main():
+    match, dist = sql_best_match()
+    if not match:
+        print("No match found.")
+        return
+
+    source_type, source_path, file_name = match
+    print(f"Best match ({dist}):")
+    print(f"Type: {source_type}")
+    print(f"Source: {source_path}")
+    print(f"File: {file_name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,135 +1,408 @@
-import os
-import sqlite3
-from pathlib import Path
-from zipfile import ZipFile, is_zipfile
-from PIL import Image
-import imagehash
-import tkinter as tk
-from tkinter import filedialog, messagebox
-
-APPDATA = Path(os.getenv("APPDATA")) / "WallpaperFinder"
-DB_PATH = APPDATA / "wallpaper_index.db"
-SETTINGS_PATH = APPDATA / "settings.json"
-
-IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"}
-
-
-def ensure_appdata():
-    APPDATA.mkdir(parents=True, exist_ok=True)
-
-
-def init_db():
-    ensure_appdata()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            source_type TEXT NOT NULL,   -- 'zip' or 'folder'
-            source_path TEXT NOT NULL,   -- full path to zip or folder
-            file_name TEXT NOT NULL,     -- internal path or filename
-            phash TEXT NOT NULL
-        )
-    """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_phash ON images(phash)")
-    conn.commit()
-    conn.close()
-
-
-def phash_image_from_bytes(data):
-    from io import BytesIO
-    with Image.open(BytesIO(data)) as img:
-        img = img.convert("RGB")
-        return imagehash.phash(img)
-
-
-def phash_image_from_path(path: Path):
-    with Image.open(path) as img:
-        img = img.convert("RGB")
-        return imagehash.phash(img)
-
-
-def index_zip(zip_path: Path):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    with ZipFile(zip_path, "r") as zf:
-        for info in zf.infolist():
-            name = info.filename
-            ext = Path(name).suffix.lower()
-            if ext not in IMAGE_EXTS:
-                continue
-            try:
-                data = zf.read(info)
-                h = phash_image_from_bytes(data)
-                cur.execute(
-                    "INSERT INTO images (source_type, source_path, file_name, phash) VALUES (?, ?, ?, ?)",
-                    ("zip", str(zip_path), name, str(h))
-                )
-            except Exception:
-                continue
-
-    conn.commit()
-    conn.close()
-
-
-def index_folder(folder: Path):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    for path in folder.rglob("*"):
-        if not path.is_file():
-            continue
-        ext = path.suffix.lower()
-        if ext not in IMAGE_EXTS:
-            continue
-        try:
-            h = phash_image_from_path(path)
-            rel = path.relative_to(folder)
-            cur.execute(
-                "INSERT INTO images (source_type, source_path, file_name, phash) VALUES (?, ?, ?, ?)",
-                ("folder", str(folder), str(rel), str(h))
-            )
-        except Exception:
-            continue
-
-    conn.commit()
-    conn.close()
-
-
-def main():
-    ensure_appdata()
-    init_db()
-
-    root = tk.Tk()
-    root.withdraw()
-
-    messagebox.showinfo(
-        "Select Image Source",
-        "Select a ZIP file or a folder containing your wallpapers."
-    )
-
-    path_str = filedialog.askopenfilename(
-        title="Select ZIP file (or cancel to choose folder)",
-        filetypes=[("ZIP files", "*.zip"), ("All files", "*.*")]
-    )
-
-    source_path = None
-    if path_str and is_zipfile(path_str):
-        source_path = Path(path_str)
-        index_zip(source_path)
-    else:
-        folder_str = filedialog.askdirectory(
-            title="Select folder containing images"
-        )
-        if not folder_str:
-            messagebox.showerror("Error", "No source selected.")
-            return
-        source_path = Path(folder_str)
-        index_folder(source_path)
-
-    messagebox.showinfo("Done", f"Indexing complete.\nSource: {source_path}\nDB: {DB_PATH}")
-
-
-if __name__ == "__main__":
-    main()
+import os
+import pickle
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+from zipfile import ZipFile, is_zipfile
+import numpy as np
+from PIL import Image
+import tkinter as tk
+from tkinter import filedialog, messagebox
+
+APPDATA = Path(os.getenv("APPDATA")) / "WallpaperFinder"
+DB_PATH = APPDATA / "wallpaper_index.db"
+HASHES_PATH = APPDATA / "hashes.bin"     # raw little-endian uint64 phashes
+AHASHES_PATH = APPDATA / "ahashes.bin"   # raw little-endian uint64 ahashes
+META_PATH = APPDATA / "meta.pkl"         # pickled (source_type, source_path, file_name) rows
+THUMBS_PATH = APPDATA / "thumbs.bin"    # packed (N, 32, 32) uint8 luma thumbnails
+SETTINGS_PATH = APPDATA / "settings.json"
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"}
+
+# Hashing is CPU-bound (PIL decode + DCT); leave half the cores for the OS/GUI.
+HASH_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+# Rows per executemany batch during bulk indexing.
+INSERT_CHUNK = 10_000
+
+
+def ensure_appdata():
+    APPDATA.mkdir(parents=True, exist_ok=True)
+
+
+def init_db():
+    ensure_appdata()
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_type TEXT NOT NULL,   -- 'zip' or 'folder'
+            source_path TEXT NOT NULL,   -- full path to zip or folder
+            file_name TEXT NOT NULL,     -- internal path or filename
+            phash INTEGER NOT NULL,      -- 64-bit hash, signed int64 reinterpret
+            ahash INTEGER                -- cheap average hash; NULL on legacy rows
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_phash ON images(phash)")
+    migrate_phash_integer(conn)
+    migrate_add_ahash(conn)
+    conn.commit()
+    conn.close()
+
+
+def phash_to_db(h) -> int:
+    """Reinterpret a 64-bit hash as signed, since SQLite INTEGER is int64."""
+    h = int(h)
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+def phash_from_db(v: int) -> int:
+    return v & 0xFFFFFFFFFFFFFFFF
+
+
+def migrate_phash_integer(conn):
+    """Rewrite a legacy phash column (hex TEXT or 8-byte BLOB) as INTEGER."""
+    cur = conn.cursor()
+    row = cur.execute(
+        "SELECT type FROM pragma_table_info('images') WHERE name = 'phash'"
+    ).fetchone()
+    if row is None or row[0] == "INTEGER":
+        return
+    legacy_text = row[0] == "TEXT"
+    cur.execute("""
+        CREATE TABLE images_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_type TEXT NOT NULL,
+            source_path TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            phash INTEGER NOT NULL
+        )
+    """)
+    rows = cur.execute(
+        "SELECT id, source_type, source_path, file_name, phash FROM images"
+    ).fetchall()
+    cur.executemany(
+        "INSERT INTO images_new (id, source_type, source_path, file_name, phash) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (
+            (rowid, src_type, src_path, name,
+             phash_to_db(int(phash, 16) if legacy_text
+                         else int.from_bytes(phash, "big")))
+            for rowid, src_type, src_path, name, phash in rows
+        ),
+    )
+    cur.execute("DROP TABLE images")
+    cur.execute("ALTER TABLE images_new RENAME TO images")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_phash ON images(phash)")
+    conn.commit()
+
+
+def migrate_add_ahash(conn):
+    """Add the ahash column to pre-ahash indexes; legacy rows stay NULL until
+    the source is re-indexed."""
+    cur = conn.cursor()
+    present = cur.execute(
+        "SELECT COUNT(*) FROM pragma_table_info('images') WHERE name = 'ahash'"
+    ).fetchone()[0]
+    if not present:
+        cur.execute("ALTER TABLE images ADD COLUMN ahash INTEGER")
+        conn.commit()
+
+
+def apply_index_pragmas(conn):
+    """Tune the connection for bulk writes: WAL avoids journal rewrites and
+    NORMAL sync skips the per-transaction fsync that dominates small inserts."""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+def bulk_insert(conn, rows):
+    """Insert all rows in one transaction, rebuilding idx_phash afterwards so
+    the B-tree is not maintained row by row during the load."""
+    cur = conn.cursor()
+    cur.execute("DROP INDEX IF EXISTS idx_phash")
+    for i in range(0, len(rows), INSERT_CHUNK):
+        cur.executemany(
+            "INSERT INTO images (source_type, source_path, file_name, phash, ahash) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows[i:i + INSERT_CHUNK]
+        )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_phash ON images(phash)")
+    conn.commit()
+
+
+def save_match_cache(conn, thumbs=None):
+    """Mirror the images table to flat sidecar files in id order.
+
+    hashes.bin / ahashes.bin are raw uint64 arrays the matcher memmaps (no
+    row factory, no parsing; the OS page cache keeps them hot), meta.pkl
+    carries the per-row metadata and is read once per index load. When the
+    indexer hands over the 32x32 luma planes they are packed into thumbs.bin
+    so later hash rebuilds never have to re-decode a source image.
+    """
+    rows = conn.execute(
+        "SELECT source_type, source_path, file_name, phash, ahash FROM images ORDER BY id"
+    ).fetchall()
+    np.fromiter(
+        (row[3] for row in rows), dtype=np.int64, count=len(rows)
+    ).view(np.uint64).tofile(HASHES_PATH)
+    if rows and all(row[4] is not None for row in rows):
+        np.fromiter(
+            (row[4] for row in rows), dtype=np.int64, count=len(rows)
+        ).view(np.uint64).tofile(AHASHES_PATH)
+    elif AHASHES_PATH.exists():
+        AHASHES_PATH.unlink()
+    with open(META_PATH, "wb") as f:
+        pickle.dump([row[:3] for row in rows], f, protocol=pickle.HIGHEST_PROTOCOL)
+    if thumbs is not None:
+        with open(THUMBS_PATH, "wb") as f:
+            f.writelines(thumbs)
+
+
+def batch_hashes(thumbs: np.ndarray):
+    """Vectorized hashes_from_plane over an (N, 32, 32) uint8 stack.
+
+    One broadcasted pair of GEMMs runs every DCT at once; the bits come out
+    identical to hashing each plane on its own.
+    """
+    a = thumbs.astype(np.float32)
+    low = (_DCT32_8 @ a @ _DCT32_8.T).reshape(len(a), 64)
+    med = np.median(low[:, 1:], axis=1, keepdims=True)
+    phs = np.packbits(low > med, axis=1).view(">u8").ravel()
+    blocks = a.reshape(-1, 8, 4, 8, 4).mean(axis=(2, 4)).reshape(-1, 64)
+    ahs = np.packbits(
+        blocks > blocks.mean(axis=1, keepdims=True), axis=1
+    ).view(">u8").ravel()
+    return phs, ahs
+
+
+# Planes per batch_hashes call when hashing a fresh index in the main process.
+HASH_BATCH = 1024
+
+
+def hash_thumb_batches(thumbs):
+    """Yield (phash, ahash) DB values for a list of packed 32x32 planes.
+
+    Workers only decode and resize; the hashes are computed here in
+    HASH_BATCH-sized stacks so one pair of GEMMs and one median pass cover
+    a thousand images instead of a thousand tiny per-image calls.
+    """
+    for i in range(0, len(thumbs), HASH_BATCH):
+        chunk = np.frombuffer(
+            b"".join(thumbs[i:i + HASH_BATCH]), dtype=np.uint8
+        ).reshape(-1, 32, 32)
+        for ph, ah in zip(*batch_hashes(chunk)):
+            yield phash_to_db(int(ph)), phash_to_db(int(ah))
+
+
+def rebuild_hashes_from_thumbs(conn):
+    """Recompute the phash/ahash columns from the thumbnail cache.
+
+    Decoding and resizing dominate indexing; thumbs.bin keeps the 32x32
+    inputs, so changing the hash algorithm only re-runs the cheap transform,
+    batched over the whole catalog, instead of re-reading every image.
+    """
+    ids = [row[0] for row in conn.execute("SELECT id FROM images ORDER BY id")]
+    thumbs = np.fromfile(THUMBS_PATH, dtype=np.uint8).reshape(-1, 32, 32)
+    if len(thumbs) != len(ids):
+        raise ValueError("thumbs.bin is out of step with the images table")
+    phs, ahs = batch_hashes(thumbs)
+    cur = conn.cursor()
+    cur.executemany(
+        "UPDATE images SET phash = ?, ahash = ? WHERE id = ?",
+        ((phash_to_db(int(ph)), phash_to_db(int(ah)), rowid)
+         for ph, ah, rowid in zip(phs, ahs, ids)),
+    )
+    conn.commit()
+    save_match_cache(conn)
+
+
+def _dct_matrix(n: int, rows: int) -> np.ndarray:
+    """First `rows` basis rows of the n-point DCT-II matrix.
+
+    The uniform DCT scale factor is dropped: the hash only compares
+    coefficients against their median, which any positive scaling preserves.
+    """
+    k = np.arange(n)
+    j = np.arange(rows)[:, None]
+    return np.cos(np.pi * j * (2 * k + 1) / (2 * n)).astype(np.float32)
+
+
+# Partial 32-point DCT: M8 @ a @ M8.T yields the 8x8 low-frequency block
+# directly as two tiny GEMMs, never computing the 24x24 block we discard.
+_DCT32_8 = _dct_matrix(32, 8)
+
+
+def luma_plane(img) -> np.ndarray:
+    """The 32x32 uint8 luma plane both hashes are computed from."""
+    if img.mode != "L":  # draft-mode JPEGs already arrive as luma
+        img = img.convert("L")
+    return np.asarray(img.resize((32, 32), Image.Resampling.BILINEAR))
+
+
+def hashes_from_plane(a: np.ndarray):
+    """(phash, ahash) from one 32x32 float32 luma plane."""
+    low = (_DCT32_8 @ a @ _DCT32_8.T).ravel()
+    med = np.median(low[1:])  # DC term would skew the median
+    ph = int.from_bytes(np.packbits(low > med).tobytes(), "big")
+    blocks = a.reshape(8, 4, 8, 4).mean(axis=(1, 3)).ravel()
+    ah = int.from_bytes(np.packbits(blocks > blocks.mean()).tobytes(), "big")
+    return ph, ah
+
+
+def hash_pair(img):
+    """(phash, ahash) of a PIL image from one 32x32 float32 luma plane.
+
+    phash is the usual construction (8x8 low-frequency DCT block vs its
+    median), with the fixed-size DCT specialized to a precomputed matrix
+    product that BLAS turns into two small GEMMs. ahash is the classic
+    average hash: 8x8 block means thresholded at their overall mean, read off
+    the same 32x32 plane for free. It is far less selective but ~free to
+    compare, so the matcher uses it as a prefilter in front of phash.
+    """
+    return hashes_from_plane(luma_plane(img).astype(np.float32))
+
+
+def fast_phash(img) -> int:
+    return hash_pair(img)[0]
+
+
+def hash_pair_from_path(path: Path):
+    with Image.open(path) as img:
+        # For JPEGs, libjpeg can decode at a reduced scale straight to
+        # grayscale; 64x64 keeps one halving step above the 32x32 hash input.
+        img.draft("L", (64, 64))
+        return hash_pair(img)
+
+
+# Worker-side ZipFile handle; ZipFile objects are not fork/pickle-safe, so
+# each pool worker opens the archive once and reuses it.
+_worker_zip = None
+
+
+def thumb_zip_entry(zip_path: str, name: str):
+    global _worker_zip
+    try:
+        if _worker_zip is None or _worker_zip.filename != zip_path:
+            _worker_zip = ZipFile(zip_path, "r")
+        # PIL's C decoders pull straight from the ZipExtFile stream, so the
+        # compressed entry is never fully materialized as a bytes object.
+        with _worker_zip.open(name) as f, Image.open(f) as img:
+            img.draft("L", (64, 64))
+            return name, luma_plane(img).tobytes()
+    except Exception:
+        return name, None
+
+
+def thumb_folder_file(path: str):
+    try:
+        with Image.open(path) as img:
+            img.draft("L", (64, 64))
+            return path, luma_plane(img).tobytes()
+    except Exception:
+        return path, None
+
+
+def index_zip(zip_path: Path):
+    with ZipFile(zip_path, "r") as zf:
+        names = [info.filename for info in zf.infolist()
+                 if Path(info.filename).suffix.lower() in IMAGE_EXTS]
+
+    metas, thumbs = [], []
+    with ProcessPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        for name, thumb in pool.map(thumb_zip_entry, repeat(str(zip_path)),
+                                    names, chunksize=16):
+            if thumb is not None:
+                metas.append(("zip", str(zip_path), name))
+                thumbs.append(thumb)
+    rows = [meta + pair for meta, pair in zip(metas, hash_thumb_batches(thumbs))]
+
+    conn = sqlite3.connect(DB_PATH)
+    apply_index_pragmas(conn)
+    bulk_insert(conn, rows)
+    save_match_cache(conn, thumbs)
+    conn.close()
+
+
+def iter_image_files(root: str):
+    """Recursive os.scandir walk yielding image paths as strings.
+
+    DirEntry.is_file/is_dir come straight from the directory listing on
+    Windows (no per-entry stat), unlike pathlib's rglob.
+    """
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and \
+                            os.path.splitext(entry.name)[1].lower() in IMAGE_EXTS:
+                        yield entry.path
+                except OSError:
+                    continue
+
+
+def index_folder(folder: Path):
+    paths = list(iter_image_files(str(folder)))
+
+    metas, thumbs = [], []
+    with ProcessPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        for path, thumb in pool.map(thumb_folder_file, paths, chunksize=16):
+            if thumb is not None:
+                rel = Path(path).relative_to(folder)
+                metas.append(("folder", str(folder), str(rel)))
+                thumbs.append(thumb)
+    rows = [meta + pair for meta, pair in zip(metas, hash_thumb_batches(thumbs))]
+
+    conn = sqlite3.connect(DB_PATH)
+    apply_index_pragmas(conn)
+    bulk_insert(conn, rows)
+    save_match_cache(conn, thumbs)
+    conn.close()
+
+
+def main():
+    ensure_appdata()
+    init_db()
+
+    root = tk.Tk()
+    root.withdraw()
+
+    messagebox.showinfo(
+        "Select Image Source",
+        "Select a ZIP file or a folder containing your wallpapers."
+    )
+
+    path_str = filedialog.askopenfilename(
+        title="Select ZIP file (or cancel to choose folder)",
+        filetypes=[("ZIP files", "*.zip"), ("All files", "*.*")]
+    )
+
+    source_path = None
+    if path_str and is_zipfile(path_str):
+        source_path = Path(path_str)
+        index_zip(source_path)
+    else:
+        folder_str = filedialog.askdirectory(
+            title="Select folder containing images"
+        )
+        if not folder_str:
+            messagebox.showerror("Error", "No source selected.")
+            return
+        source_path = Path(folder_str)
+        index_folder(source_path)
+
+    messagebox.showinfo("Done", f"Indexing complete.\nSource: {source_path}\nDB: {DB_PATH}")
+
+
+if __name__ == "__main__":
+    main()
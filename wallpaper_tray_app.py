@@ -1,466 +1,1024 @@
-import os
-import sys
-import json
-import sqlite3
-import threading
-import subprocess
-from datetime import datetime
-from pathlib import Path
-from zipfile import ZipFile, is_zipfile
-
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-
-from PIL import Image, Image as PILImage
-import imagehash
-import pystray
-from pystray import MenuItem as Item
-
-# ---- PATHS ----
-APPDATA = Path(os.getenv("APPDATA")) / "WallpaperFinder"
-SETTINGS_PATH = APPDATA / "settings.json"
-DB_PATH = APPDATA / "wallpaper_index.db"
-TRANSCODED = Path(os.getenv("APPDATA")) / "Microsoft" / "Windows" / "Themes" / "TranscodedWallpaper"
-
-ICON_PATH = Path(__file__).parent / "papersearch.ico"
-WINDOW_SIZE = "700x500"
-IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"}
-
-
-# ---- UTIL ----
-
-def ensure_appdata():
-    APPDATA.mkdir(parents=True, exist_ok=True)
-
-
-def load_settings():
-    ensure_appdata()
-    if SETTINGS_PATH.exists():
-        try:
-            with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            return {}
-    return {}
-
-
-def save_settings(data):
-    ensure_appdata()
-    with open(SETTINGS_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-
-
-def init_db():
-    ensure_appdata()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            source_type TEXT NOT NULL,
-            source_path TEXT NOT NULL,
-            file_name TEXT NOT NULL,
-            phash TEXT NOT NULL
-        )
-    """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_phash ON images(phash)")
-    conn.commit()
-    conn.close()
-
-
-def phash_image(path: Path):
-    with Image.open(path) as img:
-        img = img.convert("RGB")
-        return imagehash.phash(img)
-
-
-def phash_image_from_bytes(data: bytes):
-    from io import BytesIO
-    with Image.open(BytesIO(data)) as img:
-        img = img.convert("RGB")
-        return imagehash.phash(img)
-
-
-def open_in_explorer(full_path: Path):
-    subprocess.Popen(["explorer.exe", f"/select,{full_path}"])
-
-
-def index_source(source_type: str, source_path: Path, log_func=None):
-    init_db()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    if log_func:
-        log_func(f"Indexing {source_type}: {source_path}")
-
-    if source_type == "zip":
-        with ZipFile(source_path, "r") as zf:
-            for info in zf.infolist():
-                name = info.filename
-                ext = Path(name).suffix.lower()
-                if ext not in IMAGE_EXTS:
-                    continue
-                try:
-                    data = zf.read(info)
-                    h = phash_image_from_bytes(data)
-                    cur.execute(
-                        "INSERT INTO images (source_type, source_path, file_name, phash) VALUES (?, ?, ?, ?)",
-                        ("zip", str(source_path), name, str(h))
-                    )
-                except Exception:
-                    continue
-    else:
-        for path in source_path.rglob("*"):
-            if not path.is_file():
-                continue
-            ext = path.suffix.lower()
-            if ext not in IMAGE_EXTS:
-                continue
-            try:
-                h = phash_image(path)
-                rel = path.relative_to(source_path)
-                cur.execute(
-                    "INSERT INTO images (source_type, source_path, file_name, phash) VALUES (?, ?, ?, ?)",
-                    ("folder", str(source_path), str(rel), str(h))
-                )
-            except Exception:
-                continue
-
-    conn.commit()
-    conn.close()
-    if log_func:
-        log_func("Indexing complete.")
-
-
-def find_best_match():
-    if not TRANSCODED.exists():
-        raise FileNotFoundError(f"TranscodedWallpaper not found: {TRANSCODED}")
-    if not DB_PATH.exists():
-        raise FileNotFoundError(f"Database not found: {DB_PATH}")
-
-    wall_hash = phash_image(TRANSCODED)
-
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT source_type, source_path, file_name, phash FROM images")
-    rows = cur.fetchall()
-    conn.close()
-
-    best = None
-    best_dist = 10**9
-
-    for source_type, source_path, file_name, phash_hex in rows:
-        try:
-            stored_hash = imagehash.hex_to_hash(phash_hex)
-            dist = wall_hash - stored_hash
-        except Exception:
-            continue
-
-        if dist < best_dist:
-            best_dist = dist
-            best = (source_type, Path(source_path), file_name)
-
-    return best, best_dist
-
-
-# ---- GUI ----
-
-class WallpaperGUI:
-    def __init__(self, root, tray_app):
-        self.root = root
-        self.tray_app = tray_app
-
-        self.settings = load_settings()
-        self.source_type = self.settings.get("source_type")
-        self.source_path = Path(self.settings["source_path"]) if "source_path" in self.settings else None
-
-        self.root.title("Wallpaper Source Finder")
-        self.root.geometry(WINDOW_SIZE)
-        self.root.resizable(False, False)
-
-        ttk.Label(root, text="Source (ZIP or Folder):").pack(anchor="w", padx=10, pady=(10, 0))
-        self.source_entry = ttk.Entry(root, width=95)
-        self.source_entry.pack(padx=10)
-
-        ttk.Button(root, text="Change Source", command=self.change_source).pack(pady=3)
-
-        ttk.Label(root, text="Directory Path:").pack(anchor="w", padx=10, pady=(10, 0))
-        self.dir_entry = ttk.Entry(root, width=95)
-        self.dir_entry.pack(padx=10)
-
-        ttk.Button(root, text="Copy Directory Path",
-                   command=lambda: self.copy_to_clipboard(self.dir_entry.get())).pack(pady=3)
-
-        ttk.Label(root, text="Filename:").pack(anchor="w", padx=10, pady=(10, 0))
-        self.file_entry = ttk.Entry(root, width=95)
-        self.file_entry.pack(padx=10)
-
-        ttk.Button(root, text="Copy Filename",
-                   command=lambda: self.copy_to_clipboard(self.file_entry.get())).pack(pady=3)
-
-        ttk.Button(root, text="Refresh Now", command=self.refresh).pack(pady=10)
-
-        self.auto_var = tk.BooleanVar()
-        self.auto_var.set(self.settings.get("auto_refresh", False))
-        ttk.Checkbutton(root, text="Enable Auto-Refresh", variable=self.auto_var,
-                        command=self.toggle_auto).pack()
-
-        ttk.Label(root, text="Refresh Interval (seconds):").pack()
-        self.interval_entry = ttk.Entry(root, width=10)
-        self.interval_entry.insert(0, str(self.settings.get("interval", 5)))
-        self.interval_entry.pack()
-
-        ttk.Label(root, text="Console Log:").pack(anchor="w", padx=10, pady=(10, 0))
-        self.console = tk.Text(root, height=10, width=95, state="disabled")
-        self.console.pack(padx=10, pady=5)
-
-        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
-
-        if not self.source_path:
-            self.first_run_setup()
-        else:
-            self.source_entry.insert(0, f"{self.source_type}: {self.source_path}")
-
-        if self.auto_var.get():
-            self.schedule_refresh()
-        else:
-            self.refresh()
-
-    def log(self, text):
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        message = f"[{timestamp}] {text}\n"
-        self.console.config(state="normal")
-        self.console.insert(tk.END, message)
-        self.console.see(tk.END)
-        self.console.config(state="disabled")
-
-    def copy_to_clipboard(self, text):
-        if not text:
-            return
-        self.root.clipboard_clear()
-        self.root.clipboard_append(str(text))
-        self.log(f"Copied to clipboard: {text}")
-
-    def first_run_setup(self):
-        self.log("First run: selecting image source.")
-        messagebox.showinfo(
-            "Select Image Source",
-            "Select a ZIP file or a folder containing your wallpapers."
-        )
-
-        path_str = filedialog.askopenfilename(
-            title="Select ZIP file (or cancel to choose folder)",
-            filetypes=[("ZIP files", "*.zip"), ("All files", "*.*")]
-        )
-
-        if path_str and is_zipfile(path_str):
-            self.source_type = "zip"
-            self.source_path = Path(path_str)
-        else:
-            folder_str = filedialog.askdirectory(
-                title="Select folder containing images"
-            )
-            if not folder_str:
-                messagebox.showerror("Error", "No source selected. Exiting.")
-                self.root.after(100, self.root.quit)
-                return
-            self.source_type = "folder"
-            self.source_path = Path(folder_str)
-
-        self.settings["source_type"] = self.source_type
-        self.settings["source_path"] = str(self.source_path)
-        save_settings(self.settings)
-
-        self.source_entry.delete(0, tk.END)
-        self.source_entry.insert(0, f"{self.source_type}: {self.source_path}")
-
-        threading.Thread(
-            target=index_source,
-            args=(self.source_type, self.source_path, self.log),
-            daemon=True
-        ).start()
-
-    def change_source(self):
-        messagebox.showinfo(
-            "Change Image Source",
-            "Select a new ZIP file or folder. This will rebuild the index."
-        )
-
-        path_str = filedialog.askopenfilename(
-            title="Select ZIP file (or cancel to choose folder)",
-            filetypes=[("ZIP files", "*.zip"), ("All files", "*.*")]
-        )
-
-        new_type = None
-        new_path = None
-
-        if path_str and is_zipfile(path_str):
-            new_type = "zip"
-            new_path = Path(path_str)
-        else:
-            folder_str = filedialog.askdirectory(
-                title="Select folder containing images"
-            )
-            if not folder_str:
-                self.log("Change source cancelled.")
-                return
-            new_type = "folder"
-            new_path = Path(folder_str)
-
-        self.source_type = new_type
-        self.source_path = new_path
-        self.settings["source_type"] = self.source_type
-        self.settings["source_path"] = str(self.source_path)
-        save_settings(self.settings)
-
-        self.source_entry.delete(0, tk.END)
-        self.source_entry.insert(0, f"{self.source_type}: {self.source_path}")
-
-        if DB_PATH.exists():
-            DB_PATH.unlink()
-            self.log("Old index removed.")
-
-        threading.Thread(
-            target=index_source,
-            args=(self.source_type, self.source_path, self.log),
-            daemon=True
-        ).start()
-
-    def refresh(self):
-        self.log("Refreshing...")
-        try:
-            match, dist = find_best_match()
-        except FileNotFoundError as e:
-            self.log(f"ERROR: {e}")
-            return
-        except Exception as e:
-            self.log(f"ERROR: {e}")
-            return
-
-        if not match:
-            self.log("No match found.")
-            return
-
-        source_type, source_path, file_name = match
-        self.log(f"Match: {source_type} | {source_path} | {file_name} (dist {dist})")
-
-        if source_type == "zip":
-            self.dir_entry.delete(0, tk.END)
-            self.dir_entry.insert(0, str(source_path))
-        else:
-            base_dir = source_path
-            self.dir_entry.delete(0, tk.END)
-            self.dir_entry.insert(0, str(base_dir))
-
-        self.file_entry.delete(0, tk.END)
-        self.file_entry.insert(0, file_name)
-
-        self.log("Refresh complete.")
-
-    def toggle_auto(self):
-        self.settings["auto_refresh"] = bool(self.auto_var.get())
-        try:
-            self.settings["interval"] = int(self.interval_entry.get())
-        except ValueError:
-            self.settings["interval"] = 5
-        save_settings(self.settings)
-
-        if self.auto_var.get():
-            self.log("Auto-refresh ENABLED.")
-            self.schedule_refresh()
-        else:
-            self.log("Auto-refresh DISABLED.")
-
-    def schedule_refresh(self):
-        if not self.auto_var.get():
-            return
-        try:
-            interval = int(self.interval_entry.get()) * 1000
-        except ValueError:
-            interval = 5000
-            self.log("Invalid interval. Defaulting to 5 seconds.")
-        self.refresh()
-        self.root.after(interval, self.schedule_refresh)
-
-    def quick_locate_and_copy(self):
-        self.refresh()
-        filename = self.file_entry.get().strip()
-        if filename:
-            self.copy_to_clipboard(filename)
-
-        if not self.source_type or not self.source_path:
-            self.log("No source configured.")
-            return
-
-        if self.source_type == "zip":
-            open_in_explorer(self.source_path)
-            self.log("Quick locate: ZIP highlighted.")
-        else:
-            full_path = self.source_path / filename
-            open_in_explorer(full_path)
-            self.log("Quick locate: file highlighted.")
-
-    def on_close(self):
-        self.root.withdraw()
-        self.log("Window hidden to tray.")
-
-
-# ---- TRAY APP ----
-
-class TrayApp:
-    def __init__(self):
-        self.root = tk.Tk()
-        self.root.withdraw()
-
-        self.gui = None
-
-        try:
-            img = PILImage.open(ICON_PATH)
-        except Exception:
-            img = PILImage.new("RGB", (64, 64), color=(255, 255, 255))
-
-        self.icon = pystray.Icon(
-            "WallpaperFinder",
-            img,
-            "Wallpaper Finder",
-            menu=pystray.Menu(
-                Item("Show Window", self.show_window),
-                Item("Quick Locate & Copy", self.quick_locate_and_copy),
-                Item("Refresh Now", self.refresh_now),
-                Item("Exit", self.exit_app)
-            )
-        )
-
-        threading.Thread(target=self.icon.run, daemon=True).start()
-        self.root.after(200, self.ensure_gui)
-
-    def ensure_gui(self):
-        if self.gui is None:
-            self.gui = WallpaperGUI(self.root, self)
-
-    def show_window(self, icon, item):
-        if self.gui:
-            self.gui.root.deiconify()
-            self.gui.root.lift()
-            self.gui.root.focus_force()
-            self.gui.log("Window shown from tray.")
-
-    def refresh_now(self, icon, item):
-        if self.gui:
-            self.gui.refresh()
-
-    def quick_locate_and_copy(self, icon, item):
-        if self.gui:
-            self.gui.quick_locate_and_copy()
-
-    def exit_app(self, icon, item):
-        if self.gui:
-            self.gui.log("Exiting application.")
-        self.icon.stop()
-        self.root.quit()
-        sys.exit(0)
-
-
-if __name__ == "__main__":
-    app = TrayApp()
-    app.root.mainloop()
+import os
+import sys
+import json
+import pickle
+import sqlite3
+import threading
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import repeat
+from pathlib import Path
+from zipfile import ZipFile, is_zipfile
+
+import tkinter as tk
+from tkinter import ttk, filedialog, messagebox
+
+import numpy as np
+from PIL import Image, Image as PILImage
+import pystray
+from pystray import MenuItem as Item
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# ---- PATHS ----
+APPDATA = Path(os.getenv("APPDATA")) / "WallpaperFinder"
+SETTINGS_PATH = APPDATA / "settings.json"
+DB_PATH = APPDATA / "wallpaper_index.db"
+HASHES_PATH = APPDATA / "hashes.bin"     # raw little-endian uint64 phashes
+AHASHES_PATH = APPDATA / "ahashes.bin"   # raw little-endian uint64 ahashes
+META_PATH = APPDATA / "meta.pkl"         # pickled (source_type, source_path, file_name) rows
+THUMBS_PATH = APPDATA / "thumbs.bin"    # packed (N, 32, 32) uint8 luma thumbnails
+TRANSCODED = Path(os.getenv("APPDATA")) / "Microsoft" / "Windows" / "Themes" / "TranscodedWallpaper"
+
+ICON_PATH = Path(__file__).parent / "papersearch.ico"
+WINDOW_SIZE = "700x500"
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"}
+
+# Hashing is CPU-bound (PIL decode + DCT); leave half the cores for the OS/GUI.
+HASH_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+# Rows per executemany batch during bulk indexing.
+INSERT_CHUNK = 10_000
+
+# Popcount of every byte value, used to sum Hamming distance per hash.
+_POPCOUNT8 = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+# In-process match index: loaded from disk once and reused until the DB changes.
+_match_cache = {
+    "mtime": None, "hashes": None, "ahashes": None, "meta": None, "lanes": None
+}
+
+# Wallpaper memo: Windows leaves TranscodedWallpaper untouched between
+# rotations, so its (mtime, size) decides whether anything needs re-hashing.
+_wall_cache = {"sig": None, "db_mtime": None, "hash": None, "result": None}
+
+# Long-lived read-only connection for the match path.
+_read_conn = None
+
+
+def get_read_conn():
+    """Open (once) a read-only connection; mode=ro keeps SQLite from touching
+    the journal/WAL, and the pragmas avoid re-growing the page cache per run."""
+    global _read_conn
+    if _read_conn is None:
+        _read_conn = sqlite3.connect(
+            f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False
+        )
+        _read_conn.execute("PRAGMA cache_size=-65536")
+        _read_conn.execute("PRAGMA mmap_size=268435456")
+        _read_conn.create_function(
+            "hamming", 2,
+            lambda a, b: ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count(),
+            deterministic=True,
+        )
+    return _read_conn
+
+
+def close_read_conn():
+    global _read_conn
+    if _read_conn is not None:
+        _read_conn.close()
+        _read_conn = None
+
+
+# ---- UTIL ----
+
+def ensure_appdata():
+    APPDATA.mkdir(parents=True, exist_ok=True)
+
+
+def load_settings():
+    ensure_appdata()
+    if SETTINGS_PATH.exists():
+        try:
+            with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+    return {}
+
+
+def save_settings(data):
+    ensure_appdata()
+    with open(SETTINGS_PATH, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def init_db():
+    ensure_appdata()
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_type TEXT NOT NULL,
+            source_path TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            phash INTEGER NOT NULL,
+            ahash INTEGER
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_phash ON images(phash)")
+    migrate_phash_integer(conn)
+    migrate_add_ahash(conn)
+    conn.commit()
+    conn.close()
+
+
+def phash_to_db(h) -> int:
+    """Reinterpret a 64-bit hash as signed, since SQLite INTEGER is int64."""
+    h = int(h)
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+def phash_from_db(v: int) -> int:
+    return v & 0xFFFFFFFFFFFFFFFF
+
+
+def migrate_phash_integer(conn):
+    """Rewrite a legacy phash column (hex TEXT or 8-byte BLOB) as INTEGER."""
+    cur = conn.cursor()
+    row = cur.execute(
+        "SELECT type FROM pragma_table_info('images') WHERE name = 'phash'"
+    ).fetchone()
+    if row is None or row[0] == "INTEGER":
+        return
+    legacy_text = row[0] == "TEXT"
+    cur.execute("""
+        CREATE TABLE images_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_type TEXT NOT NULL,
+            source_path TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            phash INTEGER NOT NULL
+        )
+    """)
+    rows = cur.execute(
+        "SELECT id, source_type, source_path, file_name, phash FROM images"
+    ).fetchall()
+    cur.executemany(
+        "INSERT INTO images_new (id, source_type, source_path, file_name, phash) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (
+            (rowid, src_type, src_path, name,
+             phash_to_db(int(phash, 16) if legacy_text
+                         else int.from_bytes(phash, "big")))
+            for rowid, src_type, src_path, name, phash in rows
+        ),
+    )
+    cur.execute("DROP TABLE images")
+    cur.execute("ALTER TABLE images_new RENAME TO images")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_phash ON images(phash)")
+    conn.commit()
+
+
+def migrate_add_ahash(conn):
+    """Add the ahash column to pre-ahash indexes; legacy rows stay NULL until
+    the source is re-indexed."""
+    cur = conn.cursor()
+    present = cur.execute(
+        "SELECT COUNT(*) FROM pragma_table_info('images') WHERE name = 'ahash'"
+    ).fetchone()[0]
+    if not present:
+        cur.execute("ALTER TABLE images ADD COLUMN ahash INTEGER")
+        conn.commit()
+
+
+def ensure_schema_current():
+    """Return the read connection, migrating legacy phash columns first."""
+    conn = get_read_conn()
+    row = conn.execute(
+        "SELECT type FROM pragma_table_info('images') WHERE name = 'phash'"
+    ).fetchone()
+    has_ahash = conn.execute(
+        "SELECT COUNT(*) FROM pragma_table_info('images') WHERE name = 'ahash'"
+    ).fetchone()[0]
+    if row is not None and (row[0] != "INTEGER" or not has_ahash):
+        close_read_conn()  # legacy schema needs a writable migration pass
+        rw_conn = sqlite3.connect(DB_PATH)
+        migrate_phash_integer(rw_conn)
+        migrate_add_ahash(rw_conn)
+        rw_conn.close()
+        conn = get_read_conn()
+    return conn
+
+
+def apply_index_pragmas(conn):
+    """Tune the connection for bulk writes: WAL avoids journal rewrites and
+    NORMAL sync skips the per-transaction fsync that dominates small inserts."""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+def bulk_insert(conn, rows):
+    """Insert all rows in one transaction, rebuilding idx_phash afterwards so
+    the B-tree is not maintained row by row during the load."""
+    cur = conn.cursor()
+    cur.execute("DROP INDEX IF EXISTS idx_phash")
+    for i in range(0, len(rows), INSERT_CHUNK):
+        cur.executemany(
+            "INSERT INTO images (source_type, source_path, file_name, phash, ahash) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows[i:i + INSERT_CHUNK]
+        )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_phash ON images(phash)")
+    conn.commit()
+
+
+def save_match_cache(conn, thumbs=None):
+    """Mirror the images table to flat sidecar files in id order.
+
+    hashes.bin / ahashes.bin are raw uint64 arrays the matcher memmaps (no
+    row factory, no parsing; the OS page cache keeps them hot), meta.pkl
+    carries the per-row metadata and is read once per index load. When the
+    indexer hands over the 32x32 luma planes they are packed into thumbs.bin
+    so later hash rebuilds never have to re-decode a source image.
+    """
+    rows = conn.execute(
+        "SELECT source_type, source_path, file_name, phash, ahash FROM images ORDER BY id"
+    ).fetchall()
+    np.fromiter(
+        (row[3] for row in rows), dtype=np.int64, count=len(rows)
+    ).view(np.uint64).tofile(HASHES_PATH)
+    if rows and all(row[4] is not None for row in rows):
+        np.fromiter(
+            (row[4] for row in rows), dtype=np.int64, count=len(rows)
+        ).view(np.uint64).tofile(AHASHES_PATH)
+    elif AHASHES_PATH.exists():
+        AHASHES_PATH.unlink()
+    with open(META_PATH, "wb") as f:
+        pickle.dump([row[:3] for row in rows], f, protocol=pickle.HIGHEST_PROTOCOL)
+    if thumbs is not None:
+        with open(THUMBS_PATH, "wb") as f:
+            f.writelines(thumbs)
+
+
+def batch_hashes(thumbs: np.ndarray):
+    """Vectorized hashes_from_plane over an (N, 32, 32) uint8 stack.
+
+    One broadcasted pair of GEMMs runs every DCT at once; the bits come out
+    identical to hashing each plane on its own.
+    """
+    a = thumbs.astype(np.float32)
+    low = (_DCT32_8 @ a @ _DCT32_8.T).reshape(len(a), 64)
+    med = np.median(low[:, 1:], axis=1, keepdims=True)
+    phs = np.packbits(low > med, axis=1).view(">u8").ravel()
+    blocks = a.reshape(-1, 8, 4, 8, 4).mean(axis=(2, 4)).reshape(-1, 64)
+    ahs = np.packbits(
+        blocks > blocks.mean(axis=1, keepdims=True), axis=1
+    ).view(">u8").ravel()
+    return phs, ahs
+
+
+# Planes per batch_hashes call when hashing a fresh index in the main process.
+HASH_BATCH = 1024
+
+
+def hash_thumb_batches(thumbs):
+    """Yield (phash, ahash) DB values for a list of packed 32x32 planes.
+
+    Workers only decode and resize; the hashes are computed here in
+    HASH_BATCH-sized stacks so one pair of GEMMs and one median pass cover
+    a thousand images instead of a thousand tiny per-image calls.
+    """
+    for i in range(0, len(thumbs), HASH_BATCH):
+        chunk = np.frombuffer(
+            b"".join(thumbs[i:i + HASH_BATCH]), dtype=np.uint8
+        ).reshape(-1, 32, 32)
+        for ph, ah in zip(*batch_hashes(chunk)):
+            yield phash_to_db(int(ph)), phash_to_db(int(ah))
+
+
+def rebuild_hashes_from_thumbs(conn):
+    """Recompute the phash/ahash columns from the thumbnail cache.
+
+    Decoding and resizing dominate indexing; thumbs.bin keeps the 32x32
+    inputs, so changing the hash algorithm only re-runs the cheap transform,
+    batched over the whole catalog, instead of re-reading every image.
+    """
+    ids = [row[0] for row in conn.execute("SELECT id FROM images ORDER BY id")]
+    thumbs = np.fromfile(THUMBS_PATH, dtype=np.uint8).reshape(-1, 32, 32)
+    if len(thumbs) != len(ids):
+        raise ValueError("thumbs.bin is out of step with the images table")
+    phs, ahs = batch_hashes(thumbs)
+    cur = conn.cursor()
+    cur.executemany(
+        "UPDATE images SET phash = ?, ahash = ? WHERE id = ?",
+        ((phash_to_db(int(ph)), phash_to_db(int(ah)), rowid)
+         for ph, ah, rowid in zip(phs, ahs, ids)),
+    )
+    conn.commit()
+    save_match_cache(conn)
+
+
+def _dct_matrix(n: int, rows: int) -> np.ndarray:
+    """First `rows` basis rows of the n-point DCT-II matrix.
+
+    The uniform DCT scale factor is dropped: the hash only compares
+    coefficients against their median, which any positive scaling preserves.
+    """
+    k = np.arange(n)
+    j = np.arange(rows)[:, None]
+    return np.cos(np.pi * j * (2 * k + 1) / (2 * n)).astype(np.float32)
+
+
+# Partial 32-point DCT: M8 @ a @ M8.T yields the 8x8 low-frequency block
+# directly as two tiny GEMMs, never computing the 24x24 block we discard.
+_DCT32_8 = _dct_matrix(32, 8)
+
+
+def luma_plane(img) -> np.ndarray:
+    """The 32x32 uint8 luma plane both hashes are computed from."""
+    if img.mode != "L":  # draft-mode JPEGs already arrive as luma
+        img = img.convert("L")
+    return np.asarray(img.resize((32, 32), Image.Resampling.BILINEAR))
+
+
+def hashes_from_plane(a: np.ndarray):
+    """(phash, ahash) from one 32x32 float32 luma plane."""
+    low = (_DCT32_8 @ a @ _DCT32_8.T).ravel()
+    med = np.median(low[1:])  # DC term would skew the median
+    ph = int.from_bytes(np.packbits(low > med).tobytes(), "big")
+    blocks = a.reshape(8, 4, 8, 4).mean(axis=(1, 3)).ravel()
+    ah = int.from_bytes(np.packbits(blocks > blocks.mean()).tobytes(), "big")
+    return ph, ah
+
+
+def hash_pair(img):
+    """(phash, ahash) of a PIL image from one 32x32 float32 luma plane.
+
+    phash is the usual construction (8x8 low-frequency DCT block vs its
+    median), with the fixed-size DCT specialized to a precomputed matrix
+    product that BLAS turns into two small GEMMs. ahash is the classic
+    average hash: 8x8 block means thresholded at their overall mean, read off
+    the same 32x32 plane for free. It is far less selective but ~free to
+    compare, so the matcher uses it as a prefilter in front of phash.
+    """
+    return hashes_from_plane(luma_plane(img).astype(np.float32))
+
+
+def fast_phash(img) -> int:
+    return hash_pair(img)[0]
+
+
+def hash_pair_from_path(path: Path):
+    with Image.open(path) as img:
+        # For JPEGs, libjpeg can decode at a reduced scale straight to
+        # grayscale; 64x64 keeps one halving step above the 32x32 hash input.
+        img.draft("L", (64, 64))
+        return hash_pair(img)
+
+
+def phash_image(path: Path) -> int:
+    return hash_pair_from_path(path)[0]
+
+
+def open_in_explorer(full_path: Path):
+    subprocess.Popen(["explorer.exe", f"/select,{full_path}"])
+
+
+def iter_image_files(root: str):
+    """Recursive os.scandir walk yielding image paths as strings.
+
+    DirEntry.is_file/is_dir come straight from the directory listing on
+    Windows (no per-entry stat), unlike pathlib's rglob.
+    """
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and \
+                            os.path.splitext(entry.name)[1].lower() in IMAGE_EXTS:
+                        yield entry.path
+                except OSError:
+                    continue
+
+
+# Worker-side ZipFile handle; ZipFile objects are not fork/pickle-safe, so
+# each pool worker opens the archive once and reuses it.
+_worker_zip = None
+
+
+def thumb_zip_entry(zip_path: str, name: str):
+    global _worker_zip
+    try:
+        if _worker_zip is None or _worker_zip.filename != zip_path:
+            _worker_zip = ZipFile(zip_path, "r")
+        # PIL's C decoders pull straight from the ZipExtFile stream, so the
+        # compressed entry is never fully materialized as a bytes object.
+        with _worker_zip.open(name) as f, Image.open(f) as img:
+            img.draft("L", (64, 64))
+            return name, luma_plane(img).tobytes()
+    except Exception:
+        return name, None
+
+
+def thumb_folder_file(path: str):
+    try:
+        with Image.open(path) as img:
+            img.draft("L", (64, 64))
+            return path, luma_plane(img).tobytes()
+    except Exception:
+        return path, None
+
+
+def index_source(source_type: str, source_path: Path, log_func=None):
+    init_db()
+
+    if log_func:
+        log_func(f"Indexing {source_type}: {source_path}")
+
+    metas, thumbs = [], []
+    if source_type == "zip":
+        with ZipFile(source_path, "r") as zf:
+            names = [info.filename for info in zf.infolist()
+                     if Path(info.filename).suffix.lower() in IMAGE_EXTS]
+        with ProcessPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            for name, thumb in pool.map(thumb_zip_entry,
+                                        repeat(str(source_path)),
+                                        names, chunksize=16):
+                if thumb is not None:
+                    metas.append(("zip", str(source_path), name))
+                    thumbs.append(thumb)
+    else:
+        paths = list(iter_image_files(str(source_path)))
+        with ProcessPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            for path, thumb in pool.map(thumb_folder_file, paths,
+                                        chunksize=16):
+                if thumb is not None:
+                    rel = Path(path).relative_to(source_path)
+                    metas.append(("folder", str(source_path), str(rel)))
+                    thumbs.append(thumb)
+    rows = [meta + pair for meta, pair in zip(metas, hash_thumb_batches(thumbs))]
+
+    conn = sqlite3.connect(DB_PATH)
+    apply_index_pragmas(conn)
+    bulk_insert(conn, rows)
+    save_match_cache(conn, thumbs)
+    conn.close()
+    if log_func:
+        log_func("Indexing complete.")
+
+
+if gmpy2 is not None:
+    def hamdist(a: int, b: int) -> int:
+        return int(gmpy2.hamdist(a, b))
+else:
+    # int.bit_count compiles to a single POPCNT on 3.10+; gmpy2 just shaves
+    # the XOR-object churn when it is around.
+    def hamdist(a: int, b: int) -> int:
+        return (a ^ b).bit_count()
+
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _batch_hamming(arr, q):
+        # Kernighan popcount; LLVM recognizes the idiom and emits POPCNT.
+        out = np.empty(arr.size, dtype=np.uint8)
+        one = np.uint64(1)
+        for i in numba.prange(arr.size):
+            x = arr[i] ^ q
+            d = 0
+            while x:
+                x &= x - one
+                d += 1
+            out[i] = d
+        return out
+else:
+    _batch_hamming = None
+
+
+def hamming_argmin(hashes, wall_u64):
+    """Return (index, distance) of the closest stored hash.
+
+    With numba installed the whole reduction runs as a jitted parallel
+    popcount kernel. Otherwise two stages: the popcount of one 16-bit lane
+    is a lower bound on the full distance, so every row is ranked by that
+    cheap lane first and only rows that could still beat the best seen get a
+    full popcount, bailing out on a perfect match.
+    """
+    if _batch_hamming is not None:
+        dists = _batch_hamming(np.ascontiguousarray(hashes), wall_u64)
+        best_idx = int(dists.argmin())
+        return best_idx, int(dists[best_idx])
+
+    xor = (hashes ^ wall_u64).view(np.uint8).reshape(-1, 8)
+    lane = _POPCOUNT8[xor[:, :2]].sum(axis=1)
+
+    wall_int = int(wall_u64)
+    best_idx = int(lane.argmin())
+    best = hamdist(int(hashes[best_idx]), wall_int)
+    if best == 0:
+        return best_idx, 0
+
+    # d >= lane for every row, so only lane < best can improve on it.
+    for i in np.flatnonzero(lane < best):
+        d = hamdist(int(hashes[i]), wall_int)
+        if d < best:
+            best, best_idx = d, int(i)
+            if best == 0:
+                break
+    return best_idx, best
+
+
+# A row this close to the wallpaper must match one 16-bit lane exactly
+# (pigeonhole: 4 lanes, so <=3 mismatched bits cannot touch all of them).
+PIGEON_RADIUS = 3
+
+
+def _build_lane_buckets(hashes):
+    """Split every stored hash into 4x16-bit lanes and bucket the row indices
+    by lane value: four dicts mapping u16 -> sorted index array."""
+    lanes = np.ascontiguousarray(hashes).view("<u2").reshape(-1, 4)
+    buckets = []
+    for c in range(4):
+        col = lanes[:, c]
+        order = np.argsort(col, kind="stable")
+        svals = col[order]
+        starts = np.flatnonzero(np.r_[True, svals[1:] != svals[:-1]])
+        ends = np.r_[starts[1:], svals.size]
+        buckets.append({int(svals[s]): order[s:e] for s, e in zip(starts, ends)})
+    return buckets
+
+
+def lane_buckets():
+    """Lane buckets for the cached index, built lazily once per index load."""
+    if _match_cache["lanes"] is None and _match_cache["hashes"] is not None:
+        _match_cache["lanes"] = _build_lane_buckets(_match_cache["hashes"])
+    return _match_cache["lanes"]
+
+
+def pigeonhole_argmin(hashes, buckets, wall_u64):
+    """Resolve the argmin from lane buckets when it lies within PIGEON_RADIUS.
+
+    Candidates are the union of the rows sharing any 16-bit lane with the
+    query -- typically a handful out of the whole catalog. If the best of
+    them is within the radius it is provably the global argmin (every other
+    row differs in all four lanes, i.e. by more than the radius); otherwise
+    return None and let the caller fall back to a full scan.
+    """
+    qlanes = np.array([wall_u64], dtype="<u8").view("<u2")
+    cand = [buckets[c].get(int(qlanes[c])) for c in range(4)]
+    cand = [c for c in cand if c is not None]
+    if not cand:
+        return None
+    idx = np.unique(np.concatenate(cand))
+    xor = (hashes[idx] ^ wall_u64).view(np.uint8).reshape(-1, 8)
+    dists = _POPCOUNT8[xor].sum(axis=1)
+    j = int(dists.argmin())
+    if dists[j] > PIGEON_RADIUS:
+        return None
+    return int(idx[j]), int(dists[j])
+
+
+# Candidate count kept after the ahash prefilter.
+AHASH_TOPK = 64
+
+
+def two_stage_argmin(hashes, ahashes, wall_ph_u64, wall_ah_u64):
+    """ahash-prefiltered argmin: rank every row by the cheap average-hash
+    distance, then phash-verify only the AHASH_TOPK best candidates."""
+    if ahashes.size <= AHASH_TOPK:
+        return hamming_argmin(hashes, wall_ph_u64)
+
+    xor = (ahashes ^ wall_ah_u64).view(np.uint8).reshape(-1, 8)
+    adists = _POPCOUNT8[xor].sum(axis=1)
+    cand = np.argpartition(adists, AHASH_TOPK)[:AHASH_TOPK]
+
+    wall_int = int(wall_ph_u64)
+    best_idx, best = -1, 65
+    for i in cand:
+        d = hamdist(int(hashes[i]), wall_int)
+        if d < best:
+            best, best_idx = d, int(i)
+            if best == 0:
+                break
+    return best_idx, best
+
+
+def load_match_index():
+    """Load (hashes, ahashes, meta) for the catalog, cached until the DB changes.
+
+    Hashes are memmapped from the flat sidecars when the indexer wrote them
+    (they mirror the images table in id order); otherwise everything is
+    rebuilt from the table itself.
+    """
+    mtime = DB_PATH.stat().st_mtime_ns
+    if _match_cache["mtime"] == mtime:
+        return _match_cache["hashes"], _match_cache["ahashes"], _match_cache["meta"]
+
+    close_read_conn()  # the DB may have been rebuilt as a new file
+    conn = ensure_schema_current()
+    mtime = DB_PATH.stat().st_mtime_ns
+    count = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    hashes = ahashes = meta = None
+    if HASHES_PATH.exists() and META_PATH.exists():
+        try:
+            with open(META_PATH, "rb") as f:
+                meta = pickle.load(f)
+            mm = np.memmap(HASHES_PATH, dtype="<u8", mode="r")
+            if len(meta) == count and mm.size == count:
+                hashes = mm
+                if AHASHES_PATH.exists():
+                    amm = np.memmap(AHASHES_PATH, dtype="<u8", mode="r")
+                    if amm.size == count:
+                        ahashes = amm
+            else:
+                meta = None
+        except Exception:
+            hashes = ahashes = meta = None
+
+    if meta is None:  # stale or missing sidecars: rebuild from the table
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT source_type, source_path, file_name, phash, ahash FROM images ORDER BY id"
+        )
+        rows = cur.fetchall()
+        meta = [(row[0], row[1], row[2]) for row in rows]
+        hashes = np.fromiter(
+            (row[3] for row in rows), dtype=np.int64, count=len(rows)
+        ).view(np.uint64)
+        # Rows indexed before the ahash column stay NULL; the prefilter only
+        # applies once the whole catalog has been re-indexed with both hashes.
+        if rows and all(row[4] is not None for row in rows):
+            ahashes = np.fromiter(
+                (row[4] for row in rows), dtype=np.int64, count=len(rows)
+            ).view(np.uint64)
+
+    _match_cache.update(
+        mtime=mtime, hashes=hashes, ahashes=ahashes, meta=meta, lanes=None
+    )
+    return hashes, ahashes, meta
+
+
+def find_best_match():
+    if not TRANSCODED.exists():
+        raise FileNotFoundError(f"TranscodedWallpaper not found: {TRANSCODED}")
+    if not DB_PATH.exists():
+        raise FileNotFoundError(f"Database not found: {DB_PATH}")
+
+    st = TRANSCODED.stat()
+    wall_sig = (st.st_mtime_ns, st.st_size)
+    db_mtime = DB_PATH.stat().st_mtime_ns
+
+    if _wall_cache["sig"] == wall_sig:
+        if _wall_cache["db_mtime"] == db_mtime:
+            return _wall_cache["result"]
+        wall_ph, wall_ah = _wall_cache["hash"]  # same wallpaper, index changed
+    else:
+        wall_ph, wall_ah = hash_pair_from_path(TRANSCODED)
+
+    # Unchanged re-encodes are the common case, so try a sub-ms exact lookup
+    # through the idx_phash B-tree before any Hamming scan.
+    exact = ensure_schema_current().execute(
+        "SELECT source_type, source_path, file_name FROM images WHERE phash = ? LIMIT 1",
+        (phash_to_db(wall_ph),)
+    ).fetchone()
+    if exact is not None:
+        result = (exact[0], Path(exact[1]), exact[2]), 0
+        _wall_cache.update(
+            sig=wall_sig, db_mtime=db_mtime, hash=(wall_ph, wall_ah), result=result
+        )
+        return result
+
+    hashes, ahashes, meta = load_match_index()
+    if not meta:
+        return None, 10**9
+
+    hit = pigeonhole_argmin(hashes, lane_buckets(), np.uint64(wall_ph))
+    if hit is not None:
+        best_idx, best_dist = hit
+    elif ahashes is not None:
+        best_idx, best_dist = two_stage_argmin(
+            hashes, ahashes, np.uint64(wall_ph), np.uint64(wall_ah)
+        )
+    else:
+        best_idx, best_dist = hamming_argmin(hashes, np.uint64(wall_ph))
+    source_type, source_path, file_name = meta[best_idx]
+    result = (source_type, Path(source_path), file_name), best_dist
+    _wall_cache.update(
+        sig=wall_sig, db_mtime=db_mtime, hash=(wall_ph, wall_ah), result=result
+    )
+    return result
+
+
+# ---- GUI ----
+
+class WallpaperGUI:
+    def __init__(self, root, tray_app):
+        self.root = root
+        self.tray_app = tray_app
+
+        self.settings = load_settings()
+        self.source_type = self.settings.get("source_type")
+        self.source_path = Path(self.settings["source_path"]) if "source_path" in self.settings else None
+
+        self.root.title("Wallpaper Source Finder")
+        self.root.geometry(WINDOW_SIZE)
+        self.root.resizable(False, False)
+
+        ttk.Label(root, text="Source (ZIP or Folder):").pack(anchor="w", padx=10, pady=(10, 0))
+        self.source_entry = ttk.Entry(root, width=95)
+        self.source_entry.pack(padx=10)
+
+        ttk.Button(root, text="Change Source", command=self.change_source).pack(pady=3)
+
+        ttk.Label(root, text="Directory Path:").pack(anchor="w", padx=10, pady=(10, 0))
+        self.dir_entry = ttk.Entry(root, width=95)
+        self.dir_entry.pack(padx=10)
+
+        ttk.Button(root, text="Copy Directory Path",
+                   command=lambda: self.copy_to_clipboard(self.dir_entry.get())).pack(pady=3)
+
+        ttk.Label(root, text="Filename:").pack(anchor="w", padx=10, pady=(10, 0))
+        self.file_entry = ttk.Entry(root, width=95)
+        self.file_entry.pack(padx=10)
+
+        ttk.Button(root, text="Copy Filename",
+                   command=lambda: self.copy_to_clipboard(self.file_entry.get())).pack(pady=3)
+
+        ttk.Button(root, text="Refresh Now", command=self.refresh).pack(pady=10)
+
+        self.auto_var = tk.BooleanVar()
+        self.auto_var.set(self.settings.get("auto_refresh", False))
+        ttk.Checkbutton(root, text="Enable Auto-Refresh", variable=self.auto_var,
+                        command=self.toggle_auto).pack()
+
+        ttk.Label(root, text="Refresh Interval (seconds):").pack()
+        self.interval_entry = ttk.Entry(root, width=10)
+        self.interval_entry.insert(0, str(self.settings.get("interval", 5)))
+        self.interval_entry.pack()
+
+        ttk.Label(root, text="Console Log:").pack(anchor="w", padx=10, pady=(10, 0))
+        self.console = tk.Text(root, height=10, width=95, state="disabled")
+        self.console.pack(padx=10, pady=5)
+
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        if not self.source_path:
+            self.first_run_setup()
+        else:
+            self.source_entry.insert(0, f"{self.source_type}: {self.source_path}")
+
+        if self.auto_var.get():
+            self.schedule_refresh()
+        else:
+            self.refresh()
+
+    def log(self, text):
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        message = f"[{timestamp}] {text}\n"
+        self.console.config(state="normal")
+        self.console.insert(tk.END, message)
+        self.console.see(tk.END)
+        self.console.config(state="disabled")
+
+    def copy_to_clipboard(self, text):
+        if not text:
+            return
+        self.root.clipboard_clear()
+        self.root.clipboard_append(str(text))
+        self.log(f"Copied to clipboard: {text}")
+
+    def first_run_setup(self):
+        self.log("First run: selecting image source.")
+        messagebox.showinfo(
+            "Select Image Source",
+            "Select a ZIP file or a folder containing your wallpapers."
+        )
+
+        path_str = filedialog.askopenfilename(
+            title="Select ZIP file (or cancel to choose folder)",
+            filetypes=[("ZIP files", "*.zip"), ("All files", "*.*")]
+        )
+
+        if path_str and is_zipfile(path_str):
+            self.source_type = "zip"
+            self.source_path = Path(path_str)
+        else:
+            folder_str = filedialog.askdirectory(
+                title="Select folder containing images"
+            )
+            if not folder_str:
+                messagebox.showerror("Error", "No source selected. Exiting.")
+                self.root.after(100, self.root.quit)
+                return
+            self.source_type = "folder"
+            self.source_path = Path(folder_str)
+
+        self.settings["source_type"] = self.source_type
+        self.settings["source_path"] = str(self.source_path)
+        save_settings(self.settings)
+
+        self.source_entry.delete(0, tk.END)
+        self.source_entry.insert(0, f"{self.source_type}: {self.source_path}")
+
+        threading.Thread(
+            target=index_source,
+            args=(self.source_type, self.source_path, self.log),
+            daemon=True
+        ).start()
+
+    def change_source(self):
+        messagebox.showinfo(
+            "Change Image Source",
+            "Select a new ZIP file or folder. This will rebuild the index."
+        )
+
+        path_str = filedialog.askopenfilename(
+            title="Select ZIP file (or cancel to choose folder)",
+            filetypes=[("ZIP files", "*.zip"), ("All files", "*.*")]
+        )
+
+        new_type = None
+        new_path = None
+
+        if path_str and is_zipfile(path_str):
+            new_type = "zip"
+            new_path = Path(path_str)
+        else:
+            folder_str = filedialog.askdirectory(
+                title="Select folder containing images"
+            )
+            if not folder_str:
+                self.log("Change source cancelled.")
+                return
+            new_type = "folder"
+            new_path = Path(folder_str)
+
+        self.source_type = new_type
+        self.source_path = new_path
+        self.settings["source_type"] = self.source_type
+        self.settings["source_path"] = str(self.source_path)
+        save_settings(self.settings)
+
+        self.source_entry.delete(0, tk.END)
+        self.source_entry.insert(0, f"{self.source_type}: {self.source_path}")
+
+        if DB_PATH.exists():
+            close_read_conn()  # Windows can't unlink a file with an open handle
+            DB_PATH.unlink()
+            self.log("Old index removed.")
+
+        threading.Thread(
+            target=index_source,
+            args=(self.source_type, self.source_path, self.log),
+            daemon=True
+        ).start()
+
+    def refresh(self):
+        self.log("Refreshing...")
+        try:
+            match, dist = find_best_match()
+        except FileNotFoundError as e:
+            self.log(f"ERROR: {e}")
+            return
+        except Exception as e:
+            self.log(f"ERROR: {e}")
+            return
+
+        if not match:
+            self.log("No match found.")
+            return
+
+        source_type, source_path, file_name = match
+        self.log(f"Match: {source_type} | {source_path} | {file_name} (dist {dist})")
+
+        if source_type == "zip":
+            self.dir_entry.delete(0, tk.END)
+            self.dir_entry.insert(0, str(source_path))
+        else:
+            base_dir = source_path
+            self.dir_entry.delete(0, tk.END)
+            self.dir_entry.insert(0, str(base_dir))
+
+        self.file_entry.delete(0, tk.END)
+        self.file_entry.insert(0, file_name)
+
+        self.log("Refresh complete.")
+
+    def toggle_auto(self):
+        self.settings["auto_refresh"] = bool(self.auto_var.get())
+        try:
+            self.settings["interval"] = int(self.interval_entry.get())
+        except ValueError:
+            self.settings["interval"] = 5
+        save_settings(self.settings)
+
+        if self.auto_var.get():
+            self.log("Auto-refresh ENABLED.")
+            self.schedule_refresh()
+        else:
+            self.log("Auto-refresh DISABLED.")
+
+    def schedule_refresh(self):
+        if not self.auto_var.get():
+            return
+        try:
+            interval = int(self.interval_entry.get()) * 1000
+        except ValueError:
+            interval = 5000
+            self.log("Invalid interval. Defaulting to 5 seconds.")
+        self.refresh()
+        self.root.after(interval, self.schedule_refresh)
+
+    def quick_locate_and_copy(self):
+        self.refresh()
+        filename = self.file_entry.get().strip()
+        if filename:
+            self.copy_to_clipboard(filename)
+
+        if not self.source_type or not self.source_path:
+            self.log("No source configured.")
+            return
+
+        if self.source_type == "zip":
+            open_in_explorer(self.source_path)
+            self.log("Quick locate: ZIP highlighted.")
+        else:
+            full_path = self.source_path / filename
+            open_in_explorer(full_path)
+            self.log("Quick locate: file highlighted.")
+
+    def on_close(self):
+        self.root.withdraw()
+        self.log("Window hidden to tray.")
+
+
+# ---- TRAY APP ----
+
+class TrayApp:
+    def __init__(self):
+        self.root = tk.Tk()
+        self.root.withdraw()
+
+        self.gui = None
+
+        try:
+            img = PILImage.open(ICON_PATH)
+        except Exception:
+            img = PILImage.new("RGB", (64, 64), color=(255, 255, 255))
+
+        self.icon = pystray.Icon(
+            "WallpaperFinder",
+            img,
+            "Wallpaper Finder",
+            menu=pystray.Menu(
+                Item("Show Window", self.show_window),
+                Item("Quick Locate & Copy", self.quick_locate_and_copy),
+                Item("Refresh Now", self.refresh_now),
+                Item("Exit", self.exit_app)
+            )
+        )
+
+        threading.Thread(target=self.icon.run, daemon=True).start()
+        self.root.after(200, self.ensure_gui)
+
+    def ensure_gui(self):
+        if self.gui is None:
+            self.gui = WallpaperGUI(self.root, self)
+
+    def show_window(self, icon, item):
+        if self.gui:
+            self.gui.root.deiconify()
+            self.gui.root.lift()
+            self.gui.root.focus_force()
+            self.gui.log("Window shown from tray.")
+
+    def refresh_now(self, icon, item):
+        if self.gui:
+            self.gui.refresh()
+
+    def quick_locate_and_copy(self, icon, item):
+        if self.gui:
+            self.gui.quick_locate_and_copy()
+
+    def exit_app(self, icon, item):
+        if self.gui:
+            self.gui.log("Exiting application.")
+        self.icon.stop()
+        self.root.quit()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    app = TrayApp()
+    app.root.mainloop()